@@ -43,6 +43,13 @@ fixtures = [
 # 	}
 # }
 
+doc_events = {
+	"LemonSqueezy Settings": {
+		"on_update": "lemonsqueezy.lemonsqueezy.api.clear_webhook_settings_cache",
+		"on_trash": "lemonsqueezy.lemonsqueezy.api.clear_webhook_settings_cache",
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
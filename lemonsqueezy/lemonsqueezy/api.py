@@ -1,9 +1,16 @@
 import frappe
+import functools
 import hmac
 import hashlib
-import json
+import orjson
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from frappe import _
-from frappe.utils import get_datetime, nowdate, flt
+from frappe.utils import add_to_date, get_datetime, now_datetime, nowdate, flt
+from frappe.utils.password import decrypt
 from erpnext.setup.utils import get_exchange_rate
 
 from lemonsqueezy.lemonsqueezy.checkout import (
@@ -11,9 +18,7 @@ from lemonsqueezy.lemonsqueezy.checkout import (
     resolve_checkout_request_from_token,
 )
 
-# Supported webhook events
-SUPPORTED_EVENTS = [
-    "order_created",
+SUBSCRIPTION_EVENTS = frozenset((
     "subscription_created",
     "subscription_updated",
     "subscription_cancelled",
@@ -23,41 +28,73 @@ SUPPORTED_EVENTS = [
     "subscription_unpaused",
     "subscription_payment_success",
     "subscription_payment_failed"
-]
+))
+
+# Subscription events that carry an invoice's amounts
+SUBSCRIPTION_PAYMENT_EVENTS = frozenset(("subscription_payment_success", "subscription_payment_failed"))
+
+# Supported webhook events
+SUPPORTED_EVENTS = frozenset(("order_created", *SUBSCRIPTION_EVENTS))
 
 MAX_WEBHOOK_BODY_BYTES = 2 * 1024 * 1024  # 2MB safeguard to prevent oversized payloads
 WEBHOOK_PROCESSING_SAVEPOINT = "lemonsqueezy_webhook_processing"
+WEBHOOK_TRACEBACK_FRAMES = 10  # innermost frames kept in webhook error logs
+WEBHOOK_JOB_TIMEOUT = 300  # seconds a background webhook job may run before RQ kills it
+WEBHOOK_SECRET_CACHE_TTL = 300  # seconds a decrypted webhook secret is reused before re-reading it
+
+# Decrypted webhook secrets per settings doc: {(site, settings_name): (version, cached_at, secret_bytes)}
+_SECRET_CACHE = {}
+
+# Settings doc whose secret verified the last webhook: {site: settings_name}
+_LAST_MATCHED_SETTINGS = {}
+
+# Bound once for the signature loop, which runs them for every candidate secret
+_hmac_digest = hmac.digest
+_compare_digest = hmac.compare_digest
+
+# Variant name keyword -> billing interval stored on orders and subscriptions
+# (group names are the stored values, so one search classifies the name)
+_BILLING_INTERVAL_RE = re.compile(r"(?P<Monthly>month)|(?P<Yearly>year)|(?P<Weekly>week)", re.IGNORECASE)
+
+# Cheap shape check for webhook emails before they are used to create records
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Amount fields sent in cents and stored in currency units
+ORDER_AMOUNT_FIELDS = ("subtotal", "discount_total", "tax")
+SUBSCRIPTION_AMOUNT_FIELDS = ("total", "subtotal", "tax")
 
 # Sensitive fields to remove from webhook payload when sanitizing
-SENSITIVE_FIELDS = [
+SENSITIVE_FIELDS = frozenset((
     "user_email", "customer_email", "billing_address", "shipping_address",
     "card_brand", "card_last_four", "ip_address", "user_agent"
-]
+))
 
 def sanitize_payload(data):
     """
     Remove sensitive data from webhook payload before storing.
-    Creates a deep copy to avoid modifying the original data.
+    Copies containers while redacting them, leaving the original data untouched.
     """
-    import copy
-    sanitized = copy.deepcopy(data)
-    
-    def _sanitize_dict(d):
-        if not isinstance(d, dict):
-            return
-        for key in list(d.keys()):
-            if key in SENSITIVE_FIELDS:
-                d[key] = "[REDACTED]"
-            elif isinstance(d[key], dict):
-                _sanitize_dict(d[key])
-            elif isinstance(d[key], list):
-                for item in d[key]:
-                    if isinstance(item, dict):
-                        _sanitize_dict(item)
-    
-    _sanitize_dict(sanitized)
+    if not isinstance(data, (dict, list)):
+        return data
+
+    # Walk with an explicit stack instead of one Python call per nested container
+    sanitized = data.copy()
+    stack = [sanitized]
+    while stack:
+        node = stack.pop()
+        is_dict = isinstance(node, dict)
+        for key, value in (node.items() if is_dict else enumerate(node)):
+            if is_dict and key in SENSITIVE_FIELDS:
+                node[key] = "[REDACTED]"
+            elif isinstance(value, (dict, list)):
+                node[key] = value.copy()
+                stack.append(node[key])
     return sanitized
 
+def _short_traceback():
+    """Format the exception being handled, keeping only the innermost frames."""
+    return traceback.format_exc(limit=-WEBHOOK_TRACEBACK_FRAMES)
+
 def debug_log(settings, message, title="LemonSqueezy Debug"):
     """
     Log debug message only if verbose_logging is enabled in settings.
@@ -65,6 +102,107 @@ def debug_log(settings, message, title="LemonSqueezy Debug"):
     if settings and getattr(settings, 'verbose_logging', False):
         frappe.log_error(message, title)
 
+def _get_webhook_secrets(settings_names):
+    """
+    Return (settings_name, secret_bytes) pairs for the settings docs that have a
+    webhook secret. Decrypted secrets are reused for WEBHOOK_SECRET_CACHE_TTL
+    seconds while the site's secret version is unchanged; the rest are read from
+    __Auth in one query and decrypted together.
+    """
+    now = time.time()
+    site = frappe.local.site
+    version = _get_webhook_secret_version()
+    secrets = {}
+    missing = []
+    for settings_name in settings_names:
+        cached = _SECRET_CACHE.get((site, settings_name))
+        if cached and cached[0] == version and now - cached[1] < WEBHOOK_SECRET_CACHE_TTL:
+            secrets[settings_name] = cached[2]
+        else:
+            missing.append(settings_name)
+
+    if missing:
+        rows = frappe.db.sql(
+            """
+            SELECT name, password
+            FROM `__Auth`
+            WHERE doctype = 'LemonSqueezy Settings'
+            AND fieldname = 'webhook_secret'
+            AND encrypted = 1
+            AND name IN %s
+            """,
+            (tuple(missing),),
+            as_dict=1,
+        )
+        encrypted_secrets = {row.name: row.password for row in rows}
+
+        for settings_name in missing:
+            secret = None
+            if encrypted_secrets.get(settings_name):
+                try:
+                    secret = decrypt(encrypted_secrets[settings_name]).encode("utf-8")
+                except Exception as e:
+                    frappe.log_error(f"Error decrypting webhook secret for {settings_name}: {str(e)}")
+            # A missing secret is re-read next time, so one added later works at once
+            if secret:
+                _SECRET_CACHE[(site, settings_name)] = (version, now, secret)
+            secrets[settings_name] = secret
+
+    return [(settings_name, secrets[settings_name]) for settings_name in settings_names if secrets[settings_name]]
+
+def _get_webhook_secret_version():
+    """
+    Token shared through Redis that changes whenever a settings doc is saved,
+    so every worker drops its decrypted secrets, not just the one that saved.
+    """
+    return frappe.cache().hget(
+        "lemonsqueezy",
+        "webhook_secret_version",
+        lambda: frappe.generate_hash(length=10),
+    )
+
+def _clear_cached_webhook_settings(site, settings_name):
+    _SECRET_CACHE.pop((site, settings_name), None)
+    frappe.cache().hdel("lemonsqueezy", "enabled_settings")
+    # Other processes see a new version on their next webhook and re-read their secrets
+    frappe.cache().hdel("lemonsqueezy", "webhook_secret_version")
+
+def clear_webhook_settings_cache(doc, method=None):
+    """Drop cached webhook settings data when a LemonSqueezy Settings doc is saved or deleted."""
+    clear = functools.partial(_clear_cached_webhook_settings, frappe.local.site, doc.name)
+    clear()
+    # Clear again once the save commits: a webhook arriving before the commit
+    # reads the old rows and secret and would cache them again, the list with
+    # no expiry and the secret under a fresh version token
+    frappe.db.after_commit.add(clear)
+
+def get_signature_candidate_settings():
+    """
+    Return the names of the settings docs whose secret may have signed the
+    current webhook. When the sender names its settings doc, through the
+    X-Signature-KeyId header or a ?settings= parameter on the webhook URL, only
+    that doc is checked; otherwise every enabled doc is a candidate.
+    """
+    key_id = (
+        frappe.request.headers.get("X-Signature-KeyId")
+        or frappe.request.args.get("settings")
+        or ""
+    ).strip()
+
+    if key_id:
+        settings_name = frappe.db.get_value("LemonSqueezy Settings", {"name": key_id, "enabled": 1}, "name")
+        return [settings_name] if settings_name else []
+
+    return get_enabled_settings_names()
+
+def get_enabled_settings_names():
+    """Names of the enabled LemonSqueezy Settings, cached until a settings doc is saved."""
+    return frappe.cache().hget(
+        "lemonsqueezy",
+        "enabled_settings",
+        lambda: frappe.get_all("LemonSqueezy Settings", filters={"enabled": 1}, pluck="name"),
+    )
+
 def build_webhook_idempotency_key(data, raw_body):
     """Build a stable idempotency key for the webhook payload."""
     meta = data.get("meta", {})
@@ -83,7 +221,7 @@ def build_webhook_idempotency_key(data, raw_body):
         event_id = str(event_id).strip()
         return f"{event_name}:{event_id}", resource_id or event_id
 
-    payload_hash = hashlib.sha256(raw_body or json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    payload_hash = hashlib.sha256(raw_body or orjson.dumps(data, option=orjson.OPT_SORT_KEYS)).hexdigest()
     if resource_id:
         return f"{event_name}:{resource_id}:{payload_hash}", resource_id
 
@@ -107,12 +245,17 @@ def reserve_webhook_log(event_name, payload, idempotency_key, resource_id):
     """
     Reserve a webhook log row before processing so duplicate deliveries do not
     re-run side effects. Failed rows can be retried by reusing the same record.
+    `payload` may be the raw request body as a string or a dict to serialize.
     """
-    payload_json = json.dumps(payload, indent=2)
+    payload_json = payload if isinstance(payload, str) else orjson.dumps(payload).decode()
 
     def _reuse_existing(row):
         log_doc = frappe.get_doc("LemonSqueezy Webhook Log", row.name)
-        if log_doc.status in ("Success", "Processing"):
+        if log_doc.status == "Success":
+            return log_doc, False
+        # A row left in Processing past the job timeout belongs to a job that
+        # crashed or was killed before recording its outcome; let it be retried
+        if log_doc.status == "Processing" and not _is_stale_processing_log(log_doc):
             return log_doc, False
 
         log_doc.event_name = event_name
@@ -142,12 +285,16 @@ def reserve_webhook_log(event_name, payload, idempotency_key, resource_id):
     try:
         log_doc.insert(ignore_permissions=True)
         return log_doc, True
-    except Exception:
+    except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
         existing = get_webhook_log_row(idempotency_key, for_update=True)
         if existing:
             return _reuse_existing(existing)
         raise
 
+def _is_stale_processing_log(log_doc):
+    """Whether a Processing log row is older than any job that could still be handling it."""
+    return get_datetime(log_doc.modified) < add_to_date(now_datetime(), seconds=-WEBHOOK_JOB_TIMEOUT)
+
 def get_existing_payment_entry(order_id):
     """Return an existing Payment Entry already linked to this LemonSqueezy order."""
     payment_entry = frappe.db.get_value(
@@ -165,6 +312,41 @@ def get_existing_payment_entry(order_id):
     return frappe.get_doc("Payment Entry", payment_entry.name)
 
 
+def _get_billing_interval(variant_name):
+    """Infer the billing interval from a variant name such as "Pro (Monthly)"."""
+    match = _BILLING_INTERVAL_RE.search(variant_name or "")
+    return match.lastgroup if match else None
+
+
+def _to_naive_datetime(value):
+    """Parse a LemonSqueezy timestamp and drop its UTC offset for Datetime fields."""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        # Unix timestamp; kept in UTC like the ISO strings below
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    # LemonSqueezy sends ISO 8601 ("2024-01-31T10:00:00.000000Z"); only fall back
+    # to Frappe's slower multi-format parser for anything else
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            pass
+    dt = get_datetime(value)
+    return dt.replace(tzinfo=None) if dt else None
+
+
+def _cents_to_amount(cents):
+    """Convert a LemonSqueezy integer cent amount to currency units."""
+    # Divide rather than multiply by 0.01, which is inexact (115 * 0.01 != 1.15)
+    return (cents or 0) / 100
+
+
+def _amounts_from_cents(attributes, keys):
+    """Convert the LemonSqueezy cent amounts under `keys` to currency units."""
+    return {key: _cents_to_amount(attributes.get(key)) for key in keys}
+
+
 def _normalize_email(value):
     return (value or "").strip().lower()
 
@@ -192,24 +374,25 @@ def _find_customer_by_email(user_email):
     if not normalized_email:
         return None
 
-    customer = frappe.db.get_value("Customer", {"email_id": normalized_email}, "name")
-    if customer:
-        return customer
-
-    linked_customer = frappe.db.sql(
+    # A Customer's own email wins over one linked through a Contact
+    customers = frappe.db.sql(
         """
-        SELECT dl.link_name
-        FROM `tabContact` c
-        JOIN `tabContact Email` ce ON ce.parent = c.name
-        JOIN `tabDynamic Link` dl ON dl.parent = c.name
-        WHERE ce.email_id = %s
+        SELECT name AS customer, 0 AS priority
+        FROM `tabCustomer`
+        WHERE email_id = %(email)s
+        UNION ALL
+        SELECT dl.link_name AS customer, 1 AS priority
+        FROM `tabContact Email` ce
+        JOIN `tabDynamic Link` dl ON dl.parent = ce.parent AND dl.parenttype = 'Contact'
+        WHERE ce.email_id = %(email)s
         AND dl.link_doctype = 'Customer'
+        ORDER BY priority
         LIMIT 1
         """,
-        (normalized_email,),
+        {"email": normalized_email},
         as_dict=1,
     )
-    return linked_customer[0].link_name if linked_customer else None
+    return customers[0].customer if customers else None
 
 
 def _get_customer_creation_defaults(settings):
@@ -277,7 +460,7 @@ def _ensure_contact_for_customer(customer_name, user_email, user_name=None):
         contact.insert(ignore_permissions=True)
     except Exception:
         frappe.log_error(
-            frappe.get_traceback(),
+            _short_traceback(),
             f"LemonSqueezy: failed to create Contact for customer {customer_name}",
         )
 
@@ -287,6 +470,14 @@ def ensure_customer_for_webhook(user_email, settings, user_name=None):
     if not normalized_email or not frappe.db.exists("DocType", "Customer"):
         return None
 
+    # Email fields on Customer and Contact would reject the save later on
+    if not _EMAIL_RE.match(normalized_email):
+        frappe.log_error(
+            f"LemonSqueezy webhook sent an unusable customer email: {normalized_email}",
+            "LemonSqueezy Customer Sync",
+        )
+        return None
+
     customer = _find_customer_by_email(normalized_email)
     if customer:
         _ensure_contact_for_customer(customer, normalized_email, user_name=user_name)
@@ -328,20 +519,21 @@ def _resolve_variant_mapping(variant_id):
     if not frappe.db.exists("DocType", "Subscription Plan") or not frappe.db.has_column("Subscription Plan", "product_price_id"):
         return {}
 
-    subscription_plan = frappe.db.get_value("Subscription Plan", {"product_price_id": variant_id}, "name")
-    if not subscription_plan:
-        return {}
-
     item_field = None
     for fieldname in ("item", "item_code"):
         if frappe.db.has_column("Subscription Plan", fieldname):
             item_field = fieldname
             break
 
-    mapped_item = frappe.db.get_value("Subscription Plan", subscription_plan, item_field) if item_field else None
+    # Fetch the plan and its item together instead of re-reading the plan by name
+    fields = ["name", item_field] if item_field else ["name"]
+    subscription_plan = frappe.db.get_value("Subscription Plan", {"product_price_id": variant_id}, fields, as_dict=1)
+    if not subscription_plan:
+        return {}
+
     return {
-        "item_code": mapped_item,
-        "subscription_plan": subscription_plan,
+        "item_code": subscription_plan.get(item_field) if item_field else None,
+        "subscription_plan": subscription_plan.name,
     }
 
 
@@ -422,7 +614,7 @@ def create_direct_sales_invoice(order_context, settings, customer_name, mapping,
     if not customer_name or not mapping.get("item_code") or not gateway_context.get("company"):
         return None
 
-    posting_date = get_datetime(order_context.get("order_date")).date() if order_context.get("order_date") else nowdate()
+    posting_date = _to_naive_datetime(order_context.get("order_date")).date() if order_context.get("order_date") else nowdate()
     company_currency = frappe.get_cached_value("Company", gateway_context["company"], "default_currency")
 
     invoice = frappe.new_doc("Sales Invoice")
@@ -463,10 +655,10 @@ def create_direct_payment_entry(order_context, invoice_name, gateway_context):
 
     from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 
-    payment_date = get_datetime(order_context.get("order_date")).date() if order_context.get("order_date") else nowdate()
+    payment_date = _to_naive_datetime(order_context.get("order_date")).date() if order_context.get("order_date") else nowdate()
     company_currency = frappe.get_cached_value("Company", gateway_context["company"], "default_currency")
     account_currency = (
-        frappe.get_value("Account", gateway_context["payment_account"], "account_currency")
+        frappe.get_cached_value("Account", gateway_context["payment_account"], "account_currency")
         or company_currency
     )
 
@@ -483,7 +675,7 @@ def create_direct_payment_entry(order_context, invoice_name, gateway_context):
         bank_amount=bank_amount,
     )
     payment_entry.payment_type = "Receive"
-    if frappe.db.exists("Mode of Payment", "LemonSqueezy"):
+    if frappe.get_cached_value("Mode of Payment", "LemonSqueezy", "name"):
         payment_entry.mode_of_payment = "LemonSqueezy"
     payment_entry.reference_no = order_context["order_id"]
     payment_entry.reference_date = payment_date
@@ -503,6 +695,24 @@ def create_direct_payment_entry(order_context, invoice_name, gateway_context):
     return payment_entry.name
 
 
+@contextmanager
+def _as_administrator():
+    """
+    Run the block as Administrator and restore the session user afterwards.
+    Skips the switch when the session already runs as Administrator.
+    """
+    current_user = frappe.session.user
+    if current_user == "Administrator":
+        yield
+        return
+
+    frappe.set_user("Administrator")
+    try:
+        yield
+    finally:
+        frappe.set_user(current_user)
+
+
 def sync_direct_order_to_erpnext(order_context, settings, existing_order=None):
     if not order_context.get("order_id"):
         return {}
@@ -538,9 +748,7 @@ def sync_direct_order_to_erpnext(order_context, settings, existing_order=None):
         )
         return result
 
-    current_user = frappe.session.user
-    try:
-        frappe.set_user("Administrator")
+    with _as_administrator():
         if not result["sales_invoice"]:
             result["sales_invoice"] = create_direct_sales_invoice(
                 order_context,
@@ -556,8 +764,6 @@ def sync_direct_order_to_erpnext(order_context, settings, existing_order=None):
                 result["sales_invoice"],
                 gateway_context,
             )
-    finally:
-        frappe.set_user(current_user)
 
     return result
 
@@ -567,7 +773,7 @@ def _build_order_context_from_order_created(order_data, attributes):
     first_subscription_item = attributes.get("first_subscription_item", {}) or {}
     return {
         "order_id": str(order_data.get("id") or "").strip(),
-        "paid_amount": (attributes.get("total") or 0) / 100,
+        "paid_amount": _cents_to_amount(attributes.get("total")),
         "paid_currency": (attributes.get("currency") or "USD").upper(),
         "order_date": attributes.get("created_at"),
         "user_email": attributes.get("user_email"),
@@ -583,7 +789,7 @@ def _build_order_context_from_order_created(order_data, attributes):
 def _build_order_context_from_subscription_payment(attributes):
     return {
         "order_id": str(attributes.get("order_id") or "").strip(),
-        "paid_amount": (attributes.get("total") or 0) / 100,
+        "paid_amount": _cents_to_amount(attributes.get("total")),
         "paid_currency": (attributes.get("currency") or "USD").upper(),
         "order_date": attributes.get("created_at") or attributes.get("updated_at"),
         "user_email": attributes.get("user_email"),
@@ -596,15 +802,19 @@ def _build_order_context_from_subscription_payment(attributes):
     }
 
 
-def upsert_lemonsqueezy_order(order_context, customer_name=None, sales_invoice=None, payment_entry=None, subscription_name=None):
+def upsert_lemonsqueezy_order(order_context, customer_name=None, sales_invoice=None, payment_entry=None, subscription_name=None, order_doc=None, values=None):
+    """
+    Create or update the LemonSqueezy Order for `order_context` with a single write.
+    Pass `order_doc` (existing or new) when the caller already looked it up, and
+    `values` for any extra fields to set before saving.
+    """
     if not order_context.get("order_id"):
         return None
 
-    existing_name = frappe.db.get_value("LemonSqueezy Order", {"order_id": order_context["order_id"]}, "name")
-    if existing_name:
-        order_doc = frappe.get_doc("LemonSqueezy Order", existing_name)
-    else:
-        order_doc = frappe.new_doc("LemonSqueezy Order")
+    if order_doc is None:
+        existing_name = frappe.db.get_value("LemonSqueezy Order", {"order_id": order_context["order_id"]}, "name")
+        order_doc = frappe.get_doc("LemonSqueezy Order", existing_name) if existing_name else frappe.new_doc("LemonSqueezy Order")
+    if order_doc.is_new():
         order_doc.order_id = order_context["order_id"]
 
     order_doc.status = "Paid"
@@ -615,18 +825,37 @@ def upsert_lemonsqueezy_order(order_context, customer_name=None, sales_invoice=N
     order_doc.payment_entry = payment_entry or getattr(order_doc, "payment_entry", None)
     order_doc.subscription_id = order_context.get("subscription_id") or order_doc.subscription_id
     order_doc.subscription = subscription_name or order_doc.subscription
-    order_doc.order_date = get_datetime(order_context.get("order_date")).replace(tzinfo=None) if order_context.get("order_date") else order_doc.order_date
+    order_doc.order_date = _to_naive_datetime(order_context.get("order_date")) or order_doc.order_date
     order_doc.total = flt(order_context.get("paid_amount"))
     order_doc.currency = order_context.get("paid_currency") or order_doc.currency
     order_doc.product_name = order_context.get("product_name") or order_doc.product_name
     order_doc.variant_name = order_context.get("variant_name") or order_doc.variant_name
     order_doc.variant_id = order_context.get("variant_id") or order_doc.variant_id
     order_doc.is_subscription = 1 if order_context.get("is_subscription") else 0
+    if values:
+        order_doc.update(values)
 
-    if existing_name:
+    if not order_doc.is_new():
         order_doc.save(ignore_permissions=True)
-    else:
+        return order_doc
+
+    try:
         order_doc.insert(ignore_permissions=True)
+    except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+        # A concurrent webhook for the same order inserted it first; update that row.
+        # Locking reads see the committed row, which this transaction's snapshot may not.
+        existing_name = frappe.db.get_value("LemonSqueezy Order", {"order_id": order_context["order_id"]}, "name", for_update=True)
+        if not existing_name:
+            raise
+        return upsert_lemonsqueezy_order(
+            order_context,
+            customer_name=customer_name,
+            sales_invoice=sales_invoice,
+            payment_entry=payment_entry,
+            subscription_name=subscription_name,
+            order_doc=frappe.get_doc("LemonSqueezy Order", existing_name, for_update=True),
+            values=values,
+        )
     return order_doc
 
 @frappe.whitelist(allow_guest=True)
@@ -643,6 +872,23 @@ def handle_webhook():
             frappe.local.response['http_status_code'] = 401
             return {"status": "error", "message": "No signature provided"}
 
+    # Compare raw digests so no candidate HMAC has to be hex-encoded
+    try:
+        signature_bytes = bytes.fromhex(signature)
+    except ValueError:
+        frappe.log_error("Malformed signature in LemonSqueezy webhook", "LemonSqueezy Webhook Error")
+        frappe.local.response['http_status_code'] = 401
+        return {"status": "error", "message": "Invalid signature"}
+
+    # Refuse oversized bodies from their declared length, before reading them
+    if (frappe.request.content_length or 0) > MAX_WEBHOOK_BODY_BYTES:
+        frappe.log_error(
+                f"Webhook Content-Length exceeded size limit ({frappe.request.content_length} bytes)",
+                "LemonSqueezy Webhook Error",
+        )
+        frappe.local.response['http_status_code'] = 413
+        return {"status": "error", "message": "Payload too large"}
+
     raw_body = frappe.request.get_data()
 
     if not raw_body:
@@ -659,33 +905,41 @@ def handle_webhook():
         return {"status": "error", "message": "Payload too large"}
 
     # Find the correct settings doc that matches the signature
-    settings_list = frappe.get_all("LemonSqueezy Settings", fields=["name"], filters={"enabled": 1})
-    
-    if not settings_list:
+    settings_names = get_signature_candidate_settings()
+
+    if not settings_names:
         frappe.log_error("No enabled LemonSqueezy Settings found", "LemonSqueezy Webhook Error")
         frappe.local.response['http_status_code'] = 401
         return {"status": "error", "message": "No enabled settings"}
     
+    # Try the settings doc that matched last first; usually only one ever matches
+    last_matched = _LAST_MATCHED_SETTINGS.get(frappe.local.site)
+    candidates = sorted(
+        _get_webhook_secrets(settings_names),
+        key=lambda candidate: candidate[0] != last_matched,
+    )
+
+    matched_settings = None
+    tried_secrets = set()
+    for settings_name, secret in candidates:
+        # Settings docs sharing a secret produce the same digest
+        if secret in tried_secrets:
+            continue
+        tried_secrets.add(secret)
+
+        # One-shot C call into OpenSSL's HMAC, no intermediate HMAC object
+        if _compare_digest(_hmac_digest(secret, raw_body, "sha256"), signature_bytes):
+            matched_settings = settings_name
+            break
+
     valid_settings = None
-    
-    for settings_doc in settings_list:
+    if matched_settings:
+        _LAST_MATCHED_SETTINGS[frappe.local.site] = matched_settings
         try:
-            settings = frappe.get_doc("LemonSqueezy Settings", settings_doc.name)
-            webhook_secret = settings.get_password("webhook_secret")
-            
-            if not webhook_secret:
-                continue
-                
-            secret = webhook_secret.encode('utf-8')
-            digest = hmac.new(secret, raw_body, hashlib.sha256).hexdigest()
-            
-            if hmac.compare_digest(digest, signature):
-                valid_settings = settings
-                break
+            valid_settings = frappe.get_cached_doc("LemonSqueezy Settings", matched_settings)
         except Exception as e:
-            frappe.log_error(f"Error validating signature for {settings_doc.name}: {str(e)}")
-            continue
-            
+            frappe.log_error(f"Error loading LemonSqueezy Settings {matched_settings}: {str(e)}")
+
     if not valid_settings:
         frappe.log_error("Invalid signature in LemonSqueezy webhook", "LemonSqueezy Webhook Error")
         frappe.local.response['http_status_code'] = 401
@@ -693,8 +947,8 @@ def handle_webhook():
         
     # Process payload
     try:
-        data = json.loads(raw_body)
-    except Exception as e:
+        data = orjson.loads(raw_body)
+    except orjson.JSONDecodeError as e:
         frappe.log_error(f"Invalid JSON in webhook: {str(e)}", "LemonSqueezy Webhook Error")
         frappe.local.response['http_status_code'] = 400
         return {"status": "error", "message": "Invalid JSON"}
@@ -708,18 +962,20 @@ def handle_webhook():
 
     # Validate event is supported
     if event_name not in SUPPORTED_EVENTS:
-            frappe.log_error(
-                    f"Unsupported event type: {event_name}",
-                    "LemonSqueezy Webhook",
-            )
+            # Routine for stores subscribed to more events; keep it out of Error Log
+            frappe.logger("lemonsqueezy", allow_site=True).info(f"Ignoring unsupported webhook event: {event_name}")
             return {"status": "success", "message": "Event not supported"}
     
-    # Prepare payload for logging (optionally sanitized)
-    log_payload = data
+    # Prepare payload for logging (optionally sanitized). Unsanitized payloads
+    # are stored exactly as received instead of being re-serialized.
     if getattr(valid_settings, 'sanitize_webhook_payload', False):
         log_payload = sanitize_payload(data)
+    else:
+        log_payload = raw_body.decode("utf-8", errors="replace")
 
     idempotency_key, resource_id = build_webhook_idempotency_key(data, raw_body)
+    # The log row doubles as the idempotency lock (unique key + FOR UPDATE), so
+    # it has to be written in this request; it cannot be buffered and flushed later.
     log_doc, should_process = reserve_webhook_log(
         event_name=event_name,
         payload=log_payload,
@@ -731,38 +987,73 @@ def handle_webhook():
         frappe.db.rollback()
         return {"status": "success", "message": "Event already processed"}
 
-    frappe.db.sql(f"SAVEPOINT {WEBHOOK_PROCESSING_SAVEPOINT}")
+    if getattr(valid_settings, "process_webhooks_in_background", False):
+        # Persist the reservation so the worker and any redelivery can see it
+        frappe.db.commit()
+        try:
+            frappe.enqueue(
+                "lemonsqueezy.lemonsqueezy.api.process_webhook_event",
+                queue="short",
+                timeout=WEBHOOK_JOB_TIMEOUT,
+                # One job per reserved log row, even if the reservation is reused
+                job_id=f"lemonsqueezy_webhook::{log_doc.name}",
+                deduplicate=True,
+                log_name=log_doc.name,
+                event_name=event_name,
+                data=data,
+                settings_name=valid_settings.name,
+            )
+        except Exception as e:
+            # Leave the row retryable so LemonSqueezy's redelivery processes it
+            error_msg = f"Error queueing {event_name}: {str(e)}\n{_short_traceback()}"
+            frappe.log_error(error_msg, "LemonSqueezy Webhook Error")
+            log_doc.db_set({"status": "Failed", "error_message": error_msg})
+            frappe.db.commit()
+            raise
+        return {"status": "success", "message": "Event queued"}
+
+    error = _process_reserved_webhook(log_doc, event_name, data, valid_settings)
+    if error:
+        frappe.local.response['http_status_code'] = 500
+        return {"status": "error", "message": str(error)}
+
+    return {"status": "success"}
+
+def process_webhook_event(log_name, event_name, data, settings_name):
+    """Background job that processes a webhook reserved by handle_webhook."""
+    settings = frappe.get_cached_doc("LemonSqueezy Settings", settings_name)
+    log_doc = frappe.get_doc("LemonSqueezy Webhook Log", log_name)
+    _process_reserved_webhook(log_doc, event_name, data, settings)
+
+def _process_reserved_webhook(log_doc, event_name, data, settings):
+    """
+    Run the handler for a reserved webhook and record the outcome on its log.
+    Returns the exception raised by the handler, or None on success.
+    """
+    frappe.db.savepoint(WEBHOOK_PROCESSING_SAVEPOINT)
 
     # Process event
     try:
-        result = {}
-        if event_name == "order_created":
-            result = process_order_created(data, valid_settings) or {}
-        elif event_name in ["subscription_created", "subscription_updated", "subscription_cancelled", "subscription_resumed", "subscription_expired", "subscription_paused", "subscription_unpaused", "subscription_payment_success", "subscription_payment_failed"]:
-            process_subscription_event(data, valid_settings, event_name)
+        handler = WEBHOOK_EVENT_HANDLERS.get(event_name)
+        result = (handler(data, settings) if handler else None) or {}
 
+        # db_set writes the outcome directly; the log has no validation or versioning to run
+        outcome = {"status": "Success", "error_message": None}
         if result.get("payment_entry_name"):
-            log_doc.payment_entry = result["payment_entry_name"]
-        log_doc.status = "Success"
-        log_doc.error_message = None
-        log_doc.save(ignore_permissions=True)
+            outcome["payment_entry"] = result["payment_entry_name"]
+        log_doc.db_set(outcome)
         frappe.db.commit()
     except Exception as e:
-        frappe.db.sql(f"ROLLBACK TO SAVEPOINT {WEBHOOK_PROCESSING_SAVEPOINT}")
-        error_msg = f"Error processing {event_name}: {str(e)}\\n{frappe.get_traceback()}"
+        frappe.db.rollback(save_point=WEBHOOK_PROCESSING_SAVEPOINT)
+        error_msg = f"Error processing {event_name}: {str(e)}\n{_short_traceback()}"
         frappe.log_error(error_msg, "LemonSqueezy Webhook Error")
         
         # Update log with error
-        log_doc = frappe.get_doc("LemonSqueezy Webhook Log", log_doc.name)
-        log_doc.status = "Failed"
-        log_doc.error_message = error_msg
-        log_doc.save(ignore_permissions=True)
+        log_doc.db_set({"status": "Failed", "error_message": error_msg})
         frappe.db.commit()
-        
-        frappe.local.response['http_status_code'] = 500
-        return {"status": "error", "message": str(e)}
-    
-    return {"status": "success"}
+        return e
+
+    return None
 
 def process_order_created(data, settings):
     """Process order_created webhook event"""
@@ -771,10 +1062,10 @@ def process_order_created(data, settings):
     payment_entry_name = None
     sales_invoice_name = None
 
-    paid_amount = (attributes.get("total") or 0) / 100
-    paid_currency = (attributes.get("currency") or "USD").upper()
     order_id = str(order_data.get("id"))
     order_context = _build_order_context_from_order_created(order_data, attributes)
+    paid_amount = order_context["paid_amount"]
+    paid_currency = order_context["paid_currency"]
     existing_order_name = frappe.db.get_value("LemonSqueezy Order", {"order_id": order_id}, "name")
     existing_order = frappe.get_doc("LemonSqueezy Order", existing_order_name) if existing_order_name else None
     customer_name = existing_order.customer if existing_order and getattr(existing_order, "customer", None) else _find_customer_by_email(order_context.get("user_email"))
@@ -785,10 +1076,11 @@ def process_order_created(data, settings):
     # Update Payment Request if exists
     if payment_request_id:
         try:
-            if not frappe.db.exists("Payment Request", payment_request_id):
+            # Plain column read; the full document is only loaded to run its hooks
+            pr = frappe.db.get_value("Payment Request", payment_request_id, "*", as_dict=1)
+            if not pr:
                 frappe.log_error(f"Payment Request {payment_request_id} not found")
             else:
-                pr = frappe.get_doc("Payment Request", payment_request_id)
                 should_mark_paid = True
                 expected_amount = (
                     pr.get("payment_amount")
@@ -829,89 +1121,86 @@ def process_order_created(data, settings):
 
                 if should_mark_paid:
                     # Create or reuse Payment Entry before marking the Payment Request as paid.
-                    current_user = frappe.session.user
-                    try:
-                        frappe.set_user("Administrator")
-
-                        payment_entry = get_existing_payment_entry(order_id)
-                        if payment_entry:
-                            if payment_entry.docstatus == 0:
+                    with _as_administrator():
+                        try:
+                            payment_entry = get_existing_payment_entry(order_id)
+                            if payment_entry:
+                                if payment_entry.docstatus == 0:
+                                    payment_entry.submit()
+                                debug_log(
+                                    settings,
+                                    f"Reusing existing Payment Entry {payment_entry.name} for Order {order_id}",
+                                )
+                            else:
+                                from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+                                # Get company and accounts from Payment Request
+                                company = pr.company
+                                payment_account = pr.payment_account
+
+                                # Handle Currency Conversion for Paid Amount
+                                source_amount = flt(pr.grand_total)
+                                source_currency = pr.currency
+                                target_currency = frappe.get_cached_value("Account", payment_account, "account_currency") or frappe.get_cached_value('Company',  company,  "default_currency")
+
+                                paid_amount = source_amount
+                                if source_currency != target_currency:
+                                    exchange_rate = get_exchange_rate(source_currency, target_currency, _to_naive_datetime(attributes.get("created_at")).date() if attributes.get("created_at") else nowdate())
+                                    paid_amount = flt(source_amount) * flt(exchange_rate)
+
+                                # Create Payment Entry using ERPNext utility
+                                # This automatically handles outstanding amount, currency, and references
+                                payment_entry = get_payment_entry(
+                                    dt=pr.reference_doctype,
+                                    dn=pr.reference_name,
+                                    bank_account=payment_account,
+                                    bank_amount=paid_amount
+                                )
+
+                                # Update details
+                                payment_entry.payment_type = "Receive"
+                                payment_entry.mode_of_payment = "LemonSqueezy" if frappe.get_cached_value("Mode of Payment", "LemonSqueezy", "name") else payment_entry.mode_of_payment
+                                payment_entry.reference_no = order_id
+                                payment_entry.reference_date = _to_naive_datetime(attributes.get("created_at")).date() if attributes.get("created_at") else nowdate()
+                                payment_entry.posting_date = payment_entry.reference_date
+
+                                # Ensure amounts are correct (get_payment_entry might default to outstanding)
+                                payment_entry.paid_amount = flt(paid_amount)
+                                payment_entry.received_amount = flt(paid_amount)
+
+                                # Adjust allocation if necessary
+                                # get_payment_entry sets allocated_amount = outstanding_amount
+                                # We need to ensure allocated_amount <= paid_amount
+                                if payment_entry.references:
+                                    for ref in payment_entry.references:
+                                        if ref.allocated_amount > payment_entry.paid_amount:
+                                            ref.allocated_amount = payment_entry.paid_amount
+
+                                # Add remarks
+                                payment_entry.remarks = f"Payment received via LemonSqueezy for {pr.reference_doctype} {pr.reference_name}. Order ID: {order_id}. Amount: {source_amount} {source_currency} -> {paid_amount} {target_currency}"
+
+                                # Insert and submit payment entry
+                                payment_entry.insert(ignore_permissions=True)
                                 payment_entry.submit()
-                            debug_log(
-                                settings,
-                                f"Reusing existing Payment Entry {payment_entry.name} for Order {order_id}",
-                            )
-                        else:
-                            from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
-
-                            # Get company and accounts from Payment Request
-                            company = pr.company
-                            payment_account = pr.payment_account
-
-                            # Handle Currency Conversion for Paid Amount
-                            source_amount = flt(pr.grand_total)
-                            source_currency = pr.currency
-                            target_currency = frappe.get_value("Account", payment_account, "account_currency") or frappe.get_cached_value('Company',  company,  "default_currency")
-
-                            paid_amount = source_amount
-                            if source_currency != target_currency:
-                                exchange_rate = get_exchange_rate(source_currency, target_currency, get_datetime(attributes.get("created_at")).date() if attributes.get("created_at") else nowdate())
-                                paid_amount = flt(source_amount) * flt(exchange_rate)
-
-                            # Create Payment Entry using ERPNext utility
-                            # This automatically handles outstanding amount, currency, and references
-                            payment_entry = get_payment_entry(
-                                dt=pr.reference_doctype,
-                                dn=pr.reference_name,
-                                bank_account=payment_account,
-                                bank_amount=paid_amount
-                            )
 
-                            # Update details
-                            payment_entry.payment_type = "Receive"
-                            payment_entry.mode_of_payment = "LemonSqueezy" if frappe.db.exists("Mode of Payment", "LemonSqueezy") else payment_entry.mode_of_payment
-                            payment_entry.reference_no = order_id
-                            payment_entry.reference_date = get_datetime(attributes.get("created_at")).date() if attributes.get("created_at") else nowdate()
-                            payment_entry.posting_date = payment_entry.reference_date
-
-                            # Ensure amounts are correct (get_payment_entry might default to outstanding)
-                            payment_entry.paid_amount = flt(paid_amount)
-                            payment_entry.received_amount = flt(paid_amount)
-
-                            # Adjust allocation if necessary
-                            # get_payment_entry sets allocated_amount = outstanding_amount
-                            # We need to ensure allocated_amount <= paid_amount
-                            if payment_entry.references:
-                                for ref in payment_entry.references:
-                                    if ref.allocated_amount > payment_entry.paid_amount:
-                                        ref.allocated_amount = payment_entry.paid_amount
-
-                            # Add remarks
-                            payment_entry.remarks = f"Payment received via LemonSqueezy for {pr.reference_doctype} {pr.reference_name}. Order ID: {order_id}. Amount: {source_amount} {source_currency} -> {paid_amount} {target_currency}"
-
-                            # Insert and submit payment entry
-                            payment_entry.insert(ignore_permissions=True)
-                            payment_entry.submit()
-
-                            debug_log(settings, f"Payment Entry {payment_entry.name} created for Order {order_id}")
-
-                        payment_entry_name = payment_entry.name
-
-                        if pr.status != "Paid":
-                            pr.status = "Paid"
-                            pr.db_set("status", "Paid")
-                            pr.run_method("on_payment_authorized", "Completed")
-                        if not customer_name:
-                            customer_name = _find_customer_by_email(order_context.get("user_email"))
-                    except Exception as pe_error:
-                        frappe.log_error(
-                            f"Error creating Payment Entry for PR {payment_request_id}: {str(pe_error)}\n{frappe.get_traceback()}",
-                            "LemonSqueezy Payment Entry Error"
-                        )
-                        raise
-                    finally:
-                        # Restore original user
-                        frappe.set_user(current_user)
+                                debug_log(settings, f"Payment Entry {payment_entry.name} created for Order {order_id}")
+
+                            payment_entry_name = payment_entry.name
+
+                            if pr.status != "Paid":
+                                frappe.db.set_value("Payment Request", payment_request_id, "status", "Paid")
+                                # Loaded after the update so the hook sees the Paid status
+                                frappe.get_doc("Payment Request", payment_request_id).run_method(
+                                    "on_payment_authorized", "Completed"
+                                )
+                            if not customer_name:
+                                customer_name = _find_customer_by_email(order_context.get("user_email"))
+                        except Exception as pe_error:
+                            frappe.log_error(
+                                f"Error creating Payment Entry for PR {payment_request_id}: {str(pe_error)}\n{_short_traceback()}",
+                                "LemonSqueezy Payment Entry Error"
+                            )
+                            raise
         except Exception as e:
             frappe.log_error(f"Error processing order_created for PR {payment_request_id}: {str(e)}")
             raise
@@ -931,21 +1220,14 @@ def process_order_created(data, settings):
 
     # Store order data in LemonSqueezy Order
     try:
-        order_doc = upsert_lemonsqueezy_order(
-            order_context,
-            customer_name=customer_name,
-            sales_invoice=sales_invoice_name,
-            payment_entry=payment_entry_name,
-            subscription_name=subscription_link_name,
-        )
         first_item = attributes.get("first_order_item", {}) or {}
-        order_doc.subtotal = (attributes.get("subtotal") or 0) / 100
-        order_doc.discount_total = (attributes.get("discount_total") or 0) / 100
-        order_doc.tax = (attributes.get("tax") or 0) / 100
-        order_doc.product_id = str(first_item.get("product_id")) if first_item.get("product_id") else order_doc.product_id
-        order_doc.first_order = 1 if first_item.get("price_id") is not None else order_doc.first_order
+        order_values = _amounts_from_cents(attributes, ORDER_AMOUNT_FIELDS)
+        if first_item.get("product_id"):
+            order_values["product_id"] = str(first_item.get("product_id"))
+        if first_item.get("price_id") is not None:
+            order_values["first_order"] = 1
 
-        if order_context.get("subscription_id") and not order_doc.billing_interval:
+        if order_context.get("subscription_id") and not (existing_order and existing_order.billing_interval):
             try:
                 sub = frappe.db.get_value(
                     "LemonSqueezy Subscription",
@@ -953,20 +1235,23 @@ def process_order_created(data, settings):
                     ["variant_name"],
                     as_dict=1
                 )
-                if sub and sub.variant_name:
-                    variant_lower = sub.variant_name.lower()
-                    if "month" in variant_lower:
-                        order_doc.billing_interval = "Monthly"
-                    elif "year" in variant_lower:
-                        order_doc.billing_interval = "Yearly"
-                    elif "week" in variant_lower:
-                        order_doc.billing_interval = "Weekly"
+                billing_interval = _get_billing_interval(sub.variant_name) if sub else None
+                if billing_interval:
+                    order_values["billing_interval"] = billing_interval
             except Exception:
                 pass
 
-        order_doc.save(ignore_permissions=True)
+        upsert_lemonsqueezy_order(
+            order_context,
+            customer_name=customer_name,
+            sales_invoice=sales_invoice_name,
+            payment_entry=payment_entry_name,
+            subscription_name=subscription_link_name,
+            order_doc=existing_order or frappe.new_doc("LemonSqueezy Order"),
+            values=order_values,
+        )
     except Exception as e:
-        frappe.log_error(f"Error storing order data: {str(e)}\\n{frappe.get_traceback()}", "LemonSqueezy Order Error")
+        frappe.log_error(f"Error storing order data: {str(e)}\n{_short_traceback()}", "LemonSqueezy Order Error")
         raise
 
     return {
@@ -974,13 +1259,35 @@ def process_order_created(data, settings):
         "sales_invoice": sales_invoice_name,
     }
 
-def process_subscription_event(data, settings, event_name):
-    """Process subscription-related webhook events"""
+# (attribute, LemonSqueezy Subscription field, transform) copied when the attribute is set
+SUBSCRIPTION_FIELD_MAP = (
+    ("product_id", "product_id", str),
+    ("variant_id", "variant_id", str),
+    ("product_name", "product_name", None),
+    ("variant_name", "variant_name", None),
+    ("order_id", "order_id", str),
+    ("renews_at", "renews_at", _to_naive_datetime),
+    ("ends_at", "ends_at", _to_naive_datetime),
+    ("trial_ends_at", "trial_ends_at", _to_naive_datetime),
+)
+
+# (attributes.urls key, LemonSqueezy Subscription field)
+SUBSCRIPTION_URL_FIELD_MAP = (
+    ("update_payment_method", "update_url"),
+    ("customer_portal", "cancel_url"),
+)
+
+def process_subscription_event(data, settings, event_name, for_update=False):
+    """
+    Process subscription-related webhook events.
+    `for_update` reads the subscription with a locking read, which sees rows
+    committed after this transaction's snapshot.
+    """
     subscription_data = data.get("data", {})
     attributes = subscription_data.get("attributes", {})
     
     # Handle payment events where data is an invoice, not the subscription itself
-    if event_name in ["subscription_payment_success", "subscription_payment_failed"]:
+    if event_name in SUBSCRIPTION_PAYMENT_EVENTS:
         subscription_id = str(attributes.get("subscription_id"))
         # Invoice status is 'paid'/'pending'/'failed', not subscription status
         # We don't update subscription status based on invoice status directly here
@@ -993,39 +1300,25 @@ def process_subscription_event(data, settings, event_name):
         frappe.log_error("No subscription_id in webhook data")
         return
         
-    customer_id = attributes.get("customer_id")
-    product_id = attributes.get("product_id")
-    variant_id = attributes.get("variant_id")
-    
-    # Dates
-    renews_at = attributes.get("renews_at")
-    ends_at = attributes.get("ends_at")
-    trial_ends_at = attributes.get("trial_ends_at")
-    
-    # URLs
-    urls = attributes.get("urls", {})
-    update_url = urls.get("update_payment_method")
-    cancel_url = urls.get("customer_portal")
-    
-    # Product info
-    product_name = attributes.get("product_name")
     variant_name = attributes.get("variant_name")
     user_email = attributes.get("user_email")
     order_id = attributes.get("order_id")
     
     # Check if subscription exists using proper query
-    existing_name = frappe.db.get_value("LemonSqueezy Subscription", {"subscription_id": subscription_id}, "name")
+    existing_name = frappe.db.get_value("LemonSqueezy Subscription", {"subscription_id": subscription_id}, "name", for_update=for_update)
     
     if existing_name:
-        doc = frappe.get_doc("LemonSqueezy Subscription", existing_name)
+        doc = frappe.get_doc("LemonSqueezy Subscription", existing_name, for_update=for_update)
+        stored_values = doc.as_dict()
     else:
         # If it's a payment event and subscription doesn't exist, we can't create it properly without status
-        if event_name in ["subscription_payment_success", "subscription_payment_failed"]:
+        if event_name in SUBSCRIPTION_PAYMENT_EVENTS:
             frappe.log_error(f"Received {event_name} for unknown subscription {subscription_id}", "LemonSqueezy Webhook")
             return {"status": "success", "message": "Subscription not found, skipping payment event"}
             
         doc = frappe.new_doc("LemonSqueezy Subscription")
         doc.subscription_id = subscription_id
+        stored_values = frappe._dict()
         # Set required fields for new documents
         if not status:
             frappe.throw(_("Status is required for new subscription"))
@@ -1040,61 +1333,51 @@ def process_subscription_event(data, settings, event_name):
         if user_email:
             doc.customer_email = user_email
     
-    if product_id:
-        doc.product_id = str(product_id)
-    if variant_id:
-        doc.variant_id = str(variant_id)
-    if product_name:
-        doc.product_name = product_name
-    if variant_name:
-        doc.variant_name = variant_name
-    if order_id:
-        doc.order_id = str(order_id)
-    
-    if renews_at:
-        dt = get_datetime(renews_at)
-        doc.renews_at = dt.replace(tzinfo=None) if dt else None
-    if ends_at:
-        dt = get_datetime(ends_at)
-        doc.ends_at = dt.replace(tzinfo=None) if dt else None
-    if trial_ends_at:
-        dt = get_datetime(trial_ends_at)
-        doc.trial_ends_at = dt.replace(tzinfo=None) if dt else None
-        
-    if update_url:
-        doc.update_url = update_url
-    if cancel_url:
-        doc.cancel_url = cancel_url
-    
+    for source, fieldname, transform in SUBSCRIPTION_FIELD_MAP:
+        value = attributes.get(source)
+        if value:
+            doc.set(fieldname, transform(value) if transform else value)
+
+    urls = attributes.get("urls") or {}
+    for source, fieldname in SUBSCRIPTION_URL_FIELD_MAP:
+        if urls.get(source):
+            doc.set(fieldname, urls[source])
+
     # Financials (from payment events or if available)
-    if "total" in attributes:
-        doc.total = (attributes.get("total") or 0) / 100
-    if "subtotal" in attributes:
-        doc.subtotal = (attributes.get("subtotal") or 0) / 100
-    if "tax" in attributes:
-        doc.tax = (attributes.get("tax") or 0) / 100
+    doc.update(_amounts_from_cents(
+        attributes,
+        [key for key in SUBSCRIPTION_AMOUNT_FIELDS if key in attributes],
+    ))
     if "currency" in attributes:
         currency_code = (attributes.get("currency") or "USD").upper()
-        if frappe.db.exists("Currency", currency_code):
+        if frappe.db.get_value("Currency", currency_code, "name", cache=True):
             doc.currency = currency_code
         else:
             doc.currency = "USD"
         
     # Billing Interval
-    if variant_name:
-        variant_lower = variant_name.lower()
-        if "month" in variant_lower:
-            doc.billing_interval = "Monthly"
-        elif "year" in variant_lower:
-            doc.billing_interval = "Yearly"
-        elif "week" in variant_lower:
-            doc.billing_interval = "Weekly"
-
-    customer = ensure_customer_for_webhook(user_email, settings, user_name=attributes.get("user_name") or attributes.get("customer_name"))
-    if customer:
-        doc.customer = customer
-            
-    doc.save(ignore_permissions=True)
+    billing_interval = _get_billing_interval(variant_name)
+    if billing_interval:
+        doc.billing_interval = billing_interval
+
+    # A subscription already linked to a customer for this email needs no lookup
+    customer = doc.customer
+    if not customer or (user_email and _normalize_email(user_email) != _normalize_email(stored_values.customer_email)):
+        customer = ensure_customer_for_webhook(user_email, settings, user_name=attributes.get("user_name") or attributes.get("customer_name"))
+        if customer:
+            doc.customer = customer
+
+    if not existing_name:
+        try:
+            doc.insert(ignore_permissions=True)
+        except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+            if not frappe.db.get_value("LemonSqueezy Subscription", {"subscription_id": subscription_id}, "name", for_update=True):
+                raise
+            # A concurrent webhook created the subscription first; apply this event to that row
+            return process_subscription_event(data, settings, event_name, for_update=True)
+    # Skip the write (validation, version row, modified stamp) when the event changed nothing
+    elif doc.as_dict() != stored_values:
+        doc.save(ignore_permissions=True)
 
     if event_name == "subscription_payment_success" and order_id:
         order_context = _build_order_context_from_subscription_payment(attributes)
@@ -1107,8 +1390,18 @@ def process_subscription_event(data, settings, event_name):
             sales_invoice=erpnext_sync.get("sales_invoice"),
             payment_entry=erpnext_sync.get("payment_entry_name"),
             subscription_name=doc.name,
+            order_doc=existing_order or frappe.new_doc("LemonSqueezy Order"),
         )
 
+# Webhook event -> handler(data, settings)
+WEBHOOK_EVENT_HANDLERS = {
+    "order_created": process_order_created,
+    **{
+        event_name: functools.partial(process_subscription_event, event_name=event_name)
+        for event_name in SUBSCRIPTION_EVENTS
+    },
+}
+
 @frappe.whitelist(allow_guest=True)
 def lemonsqueezy_checkout(token=None, **kwargs):
     """
@@ -12,6 +12,12 @@ from frappe.utils import flt
 CHECKOUT_TOKEN_VERSION = 1
 CHECKOUT_TOKEN_TTL_SECONDS = 7 * 24 * 60 * 60
 
+# Header columns read to tell whether a checkout's reference document is already paid
+REFERENCE_PAYMENT_STATUS_FIELDS = {
+    "Sales Order": ["grand_total", "advance_paid", "status"],
+    "Sales Invoice": ["outstanding_amount", "status"],
+}
+
 
 def _encode_token_payload(payload_bytes):
     return base64.urlsafe_b64encode(payload_bytes).decode().rstrip("=")
@@ -159,18 +165,36 @@ def _get_payment_success_redirect(reference_doctype, reference_docname, message)
     )
 
 
-def _resolve_variant_from_subscription(subscription_name, checkout_kwargs, settings):
-    plans = frappe.get_all(
-        "Subscription Plan Detail",
-        filters={"parent": subscription_name},
-        fields=["plan"],
-        limit=1,
+def _resolve_variant_from_subscription(subscription_name, checkout_kwargs, settings, sales_invoice=None):
+    """
+    Use the product_price_id of the subscription's first plan as the variant.
+    With `sales_invoice`, the subscription is read from that invoice in the same query.
+    """
+    subscription_join = ""
+    condition = "spd.parent = %(subscription)s"
+    if sales_invoice:
+        subscription_join = "JOIN `tabSales Invoice` si ON si.subscription = spd.parent"
+        condition = "si.name = %(sales_invoice)s"
+
+    plans = frappe.db.sql(
+        f"""
+        SELECT spd.plan, sp.product_price_id
+        FROM `tabSubscription Plan Detail` spd
+        {subscription_join}
+        LEFT JOIN `tabSubscription Plan` sp ON sp.name = spd.plan
+        WHERE {condition}
+        AND spd.parenttype = 'Subscription'
+        ORDER BY spd.idx ASC
+        LIMIT 1
+        """,
+        {"subscription": subscription_name, "sales_invoice": sales_invoice},
+        as_dict=1,
     )
     if not plans:
         return
 
     plan_id = plans[0].plan
-    variant_id = frappe.db.get_value("Subscription Plan", plan_id, "product_price_id")
+    variant_id = plans[0].product_price_id
     if variant_id:
         checkout_kwargs["variant_id"] = variant_id
         if getattr(settings, "verbose_logging", False):
@@ -204,14 +228,33 @@ def _get_available_item_fields(item_doctype):
     return [fieldname for fieldname in requested_fields if frappe.db.has_column(item_doctype, fieldname)]
 
 
-def _get_item_variant_id(item_code):
-    if not item_code:
-        return None
-
-    if not frappe.db.has_column("Item", "lemonsqueezy_variant_id"):
-        return None
-
-    return frappe.db.get_value("Item", item_code, "lemonsqueezy_variant_id")
+def _get_first_item_row(item_doctype, reference_docname, item_fields):
+    """
+    Fetch the first item row of a sales document together with the variant ids
+    set on its Item and Subscription Plan, in one query.
+    """
+    columns = [f"sdi.`{fieldname}`" for fieldname in item_fields]
+    joins = []
+    if "item_code" in item_fields and frappe.db.has_column("Item", "lemonsqueezy_variant_id"):
+        columns.append("item.lemonsqueezy_variant_id AS item_variant_id")
+        joins.append("LEFT JOIN `tabItem` item ON item.name = sdi.item_code")
+    if "subscription_plan" in item_fields:
+        columns.append("plan.product_price_id AS plan_variant_id")
+        joins.append("LEFT JOIN `tabSubscription Plan` plan ON plan.name = sdi.subscription_plan")
+
+    rows = frappe.db.sql(
+        f"""
+        SELECT {", ".join(columns)}
+        FROM `tab{item_doctype}` sdi
+        {" ".join(joins)}
+        WHERE sdi.parent = %s
+        ORDER BY sdi.idx ASC
+        LIMIT 1
+        """,
+        (reference_docname,),
+        as_dict=1,
+    )
+    return rows[0] if rows else None
 
 
 def _apply_sales_document_item_checkout_data(reference_doctype, reference_docname, checkout_kwargs, settings):
@@ -226,29 +269,12 @@ def _apply_sales_document_item_checkout_data(reference_doctype, reference_docnam
     if not item_fields:
         return
 
-    items = frappe.get_all(
-        item_doctype,
-        filters={"parent": reference_docname},
-        fields=item_fields,
-        order_by="idx asc",
-        limit=1,
-    )
-    if not items:
+    item_row = _get_first_item_row(item_doctype, reference_docname, item_fields)
+    if not item_row:
         return
 
-    item_row = items[0]
     item_amount = _get_checkout_amount_from_item_row(item_row)
-    item_variant_id = None
-
-    if item_row.get("item_code"):
-        item_variant_id = _get_item_variant_id(item_row.get("item_code"))
-
-    if not item_variant_id and item_row.get("subscription_plan"):
-        item_variant_id = frappe.db.get_value(
-            "Subscription Plan",
-            item_row.get("subscription_plan"),
-            "product_price_id",
-        )
+    item_variant_id = item_row.get("item_variant_id") or item_row.get("plan_variant_id")
 
     if item_variant_id:
         checkout_kwargs["variant_id"] = item_variant_id
@@ -267,9 +293,15 @@ def _apply_reference_checkout_data(payment_request, checkout_kwargs, settings):
 
     if reference_doctype in ["Sales Order", "Sales Invoice"] and reference_docname:
         try:
-            doc = frappe.get_doc(reference_doctype, reference_docname)
+            # Only a few header columns are needed, not the document with its items
+            doc = frappe.db.get_value(
+                reference_doctype,
+                reference_docname,
+                REFERENCE_PAYMENT_STATUS_FIELDS[reference_doctype],
+                as_dict=1,
+            )
 
-            if reference_doctype == "Sales Order":
+            if doc and reference_doctype == "Sales Order":
                 outstanding_amount = flt(doc.grand_total) - flt(doc.advance_paid)
                 if outstanding_amount <= 0.01 or doc.status in ["Completed", "Closed"]:
                     return {
@@ -283,7 +315,7 @@ def _apply_reference_checkout_data(payment_request, checkout_kwargs, settings):
                 if outstanding_amount > 0 and not _has_checkout_amount(checkout_kwargs):
                     checkout_kwargs["amount"] = outstanding_amount
 
-            elif reference_doctype == "Sales Invoice":
+            elif doc and reference_doctype == "Sales Invoice":
                 outstanding_amount = flt(doc.outstanding_amount)
                 if outstanding_amount <= 0 or doc.status == "Paid":
                     return {
@@ -308,9 +340,7 @@ def _apply_reference_checkout_data(payment_request, checkout_kwargs, settings):
         )
 
     if reference_doctype == "Sales Invoice" and not checkout_kwargs.get("variant_id"):
-        subscription_name = frappe.db.get_value("Sales Invoice", reference_docname, "subscription")
-        if subscription_name:
-            _resolve_variant_from_subscription(subscription_name, checkout_kwargs, settings)
+        _resolve_variant_from_subscription(None, checkout_kwargs, settings, sales_invoice=reference_docname)
 
     elif reference_doctype == "Subscription" and reference_docname:
         _resolve_variant_from_subscription(reference_docname, checkout_kwargs, settings)
@@ -371,7 +401,8 @@ def resolve_checkout_request_from_token(token):
     if not frappe.db.exists("LemonSqueezy Settings", settings_name):
         frappe.throw(_("Checkout configuration is not available."))
 
-    settings = frappe.get_doc("LemonSqueezy Settings", settings_name)
+    settings = frappe.get_cached_doc("LemonSqueezy Settings", settings_name)
+
     if not settings.enabled:
         frappe.throw(_("Checkout configuration is disabled."))
 
@@ -29,7 +29,7 @@ frappe.ui.form.on("LemonSqueezy Settings", {
 
             // Add Copy Webhook URL button
             frm.add_custom_button(__("Copy Webhook URL"), function () {
-                const webhook_url = `${window.location.origin}/api/method/lemonsqueezy.lemonsqueezy.api.handle_webhook`;
+                const webhook_url = `${window.location.origin}/api/method/lemonsqueezy.lemonsqueezy.api.handle_webhook?settings=${encodeURIComponent(frm.doc.name)}`;
                 navigator.clipboard.writeText(webhook_url).then(
                     function () {
                         frappe.show_alert(
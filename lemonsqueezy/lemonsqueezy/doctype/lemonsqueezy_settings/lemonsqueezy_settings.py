@@ -392,11 +392,11 @@ def get_customer_portal_url_api(subscription_id):
         frappe.throw(_("Not permitted"), frappe.PermissionError)
 
     # Get any enabled LemonSqueezy Settings
-    settings = frappe.get_all("LemonSqueezy Settings", filters={"enabled": 1}, limit=1)
-    if not settings:
+    settings_name = frappe.db.get_value("LemonSqueezy Settings", {"enabled": 1}, "name")
+    if not settings_name:
         frappe.throw(_("No enabled LemonSqueezy Settings found"))
     
-    doc = frappe.get_doc("LemonSqueezy Settings", settings[0].name)
+    doc = frappe.get_cached_doc("LemonSqueezy Settings", settings_name)
     return doc.get_customer_portal_url(subscription_id)
 
 @frappe.whitelist()
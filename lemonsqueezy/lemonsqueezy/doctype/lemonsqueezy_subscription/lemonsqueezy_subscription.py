@@ -10,9 +10,9 @@ class LemonSqueezySubscription(Document):
 		
 		# Fallback: try to fetch from API
 		try:
-			settings = frappe.get_all("LemonSqueezy Settings", filters={"enabled": 1}, limit=1)
-			if settings:
-				settings_doc = frappe.get_doc("LemonSqueezy Settings", settings[0].name)
+			settings_name = frappe.db.get_value("LemonSqueezy Settings", {"enabled": 1}, "name")
+			if settings_name:
+				settings_doc = frappe.get_cached_doc("LemonSqueezy Settings", settings_name)
 				return settings_doc.get_customer_portal_url(self.subscription_id)
 		except Exception as e:
 			frappe.log_error(f"Error getting portal URL: {str(e)}")
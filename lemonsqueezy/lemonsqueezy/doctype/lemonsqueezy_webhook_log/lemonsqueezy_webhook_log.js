@@ -0,0 +1,15 @@
+// Copyright (c) 2026, Ernesto Ruiz and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("LemonSqueezy Webhook Log", {
+	refresh(frm) {
+		// Payloads are stored compact (or exactly as received); indent them for reading only
+		if (!frm.doc.payload) return;
+		try {
+			frm.doc.payload = JSON.stringify(JSON.parse(frm.doc.payload), null, 2);
+			frm.refresh_field("payload");
+		} catch (e) {
+			// Leave payloads that are not valid JSON as stored
+		}
+	},
+});
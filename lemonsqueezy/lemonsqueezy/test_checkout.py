@@ -200,34 +200,31 @@ class TestPaymentUrlIssuance(FrappeTestCase):
         def fake_get_doc(doctype, name):
             if doctype == "Payment Request":
                 return payment_request
-            if doctype == "Sales Invoice":
-                return invoice
             raise AssertionError(f"Unexpected doctype {doctype}")
 
-        def fake_get_all(doctype, **kwargs):
-            if doctype == "Sales Invoice Item":
-                self.assertEqual(
-                    kwargs["fields"],
-                    ["item_code", "net_amount", "amount", "base_net_amount", "base_amount"],
-                )
-                return [
-                    frappe._dict(
-                        {
-                            "item_code": "ITEM-001",
-                            "net_amount": 99,
-                            "amount": 108,
-                            "base_net_amount": 99,
-                            "base_amount": 108,
-                        }
-                    )
-                ]
-            return []
-
         def fake_get_value(doctype, name=None, fieldname=None, **kwargs):
-            if doctype == "Item" and name == "ITEM-001" and fieldname == "lemonsqueezy_variant_id":
-                return "VAR-001"
+            if doctype == "Sales Invoice" and fieldname == ["outstanding_amount", "status"]:
+                return invoice
             return None
 
+        def fake_sql(query, values=None, **kwargs):
+            self.assertIn("FROM `tabSales Invoice Item` sdi", query)
+            self.assertIn("item.lemonsqueezy_variant_id AS item_variant_id", query)
+            self.assertNotIn("subscription_plan", query)
+            self.assertEqual(values, ("SINV-0001",))
+            return [
+                frappe._dict(
+                    {
+                        "item_code": "ITEM-001",
+                        "net_amount": 99,
+                        "amount": 108,
+                        "base_net_amount": 99,
+                        "base_amount": 108,
+                        "item_variant_id": "VAR-001",
+                    }
+                )
+            ]
+
         with patch(
             "lemonsqueezy.lemonsqueezy.checkout.frappe.db.exists",
             return_value=True,
@@ -238,9 +235,9 @@ class TestPaymentUrlIssuance(FrappeTestCase):
             "lemonsqueezy.lemonsqueezy.checkout.frappe.get_doc",
             side_effect=fake_get_doc,
         ), patch(
-            "lemonsqueezy.lemonsqueezy.checkout.frappe.get_all",
-            side_effect=fake_get_all,
-        ), patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.sql",
+            side_effect=fake_sql,
+        ) as sql, patch(
             "lemonsqueezy.lemonsqueezy.checkout.frappe.db.get_value",
             side_effect=fake_get_value,
         ):
@@ -248,6 +245,7 @@ class TestPaymentUrlIssuance(FrappeTestCase):
 
         self.assertEqual(checkout_request["checkout_kwargs"]["variant_id"], "VAR-001")
         self.assertEqual(checkout_request["checkout_kwargs"]["amount"], 99)
+        sql.assert_called_once()
 
     def test_build_checkout_request_falls_back_when_item_custom_field_is_missing(self):
         payment_request = frappe._dict(
@@ -273,35 +271,31 @@ class TestPaymentUrlIssuance(FrappeTestCase):
         def fake_get_doc(doctype, name):
             if doctype == "Payment Request":
                 return payment_request
-            if doctype == "Sales Invoice":
-                return invoice
             raise AssertionError(f"Unexpected doctype {doctype}")
 
-        def fake_get_all(doctype, **kwargs):
-            if doctype == "Sales Invoice Item":
-                self.assertEqual(
-                    kwargs["fields"],
-                    ["item_code", "subscription_plan", "net_amount", "amount", "base_net_amount", "base_amount"],
-                )
-                return [
-                    frappe._dict(
-                        {
-                            "item_code": "ITEM-001",
-                            "subscription_plan": "PLAN-001",
-                            "net_amount": 99,
-                            "amount": 108,
-                            "base_net_amount": 99,
-                            "base_amount": 108,
-                        }
-                    )
-                ]
-            return []
-
         def fake_get_value(doctype, name=None, fieldname=None, **kwargs):
-            if doctype == "Subscription Plan" and name == "PLAN-001" and fieldname == "product_price_id":
-                return "VAR-PLAN-001"
+            if doctype == "Sales Invoice" and fieldname == ["outstanding_amount", "status"]:
+                return invoice
             return None
 
+        def fake_sql(query, values=None, **kwargs):
+            self.assertIn("sdi.`subscription_plan`", query)
+            self.assertIn("plan.product_price_id AS plan_variant_id", query)
+            self.assertNotIn("tabItem", query)
+            return [
+                frappe._dict(
+                    {
+                        "item_code": "ITEM-001",
+                        "subscription_plan": "PLAN-001",
+                        "net_amount": 99,
+                        "amount": 108,
+                        "base_net_amount": 99,
+                        "base_amount": 108,
+                        "plan_variant_id": "VAR-PLAN-001",
+                    }
+                )
+            ]
+
         def fake_has_column(doctype, fieldname):
             if doctype == "Item" and fieldname == "lemonsqueezy_variant_id":
                 return False
@@ -317,9 +311,9 @@ class TestPaymentUrlIssuance(FrappeTestCase):
             "lemonsqueezy.lemonsqueezy.checkout.frappe.get_doc",
             side_effect=fake_get_doc,
         ), patch(
-            "lemonsqueezy.lemonsqueezy.checkout.frappe.get_all",
-            side_effect=fake_get_all,
-        ), patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.sql",
+            side_effect=fake_sql,
+        ) as sql, patch(
             "lemonsqueezy.lemonsqueezy.checkout.frappe.db.get_value",
             side_effect=fake_get_value,
         ):
@@ -327,6 +321,7 @@ class TestPaymentUrlIssuance(FrappeTestCase):
 
         self.assertEqual(checkout_request["checkout_kwargs"]["variant_id"], "VAR-PLAN-001")
         self.assertEqual(checkout_request["checkout_kwargs"]["amount"], 99)
+        sql.assert_called_once()
 
     def test_build_checkout_request_keeps_payment_request_amount_over_invoice_outstanding(self):
         payment_request = frappe._dict(
@@ -352,10 +347,13 @@ class TestPaymentUrlIssuance(FrappeTestCase):
         def fake_get_doc(doctype, name):
             if doctype == "Payment Request":
                 return payment_request
-            if doctype == "Sales Invoice":
-                return invoice
             raise AssertionError(f"Unexpected doctype {doctype}")
 
+        def fake_get_value(doctype, name=None, fieldname=None, **kwargs):
+            if doctype == "Sales Invoice" and fieldname == ["outstanding_amount", "status"]:
+                return invoice
+            return None
+
         with patch(
             "lemonsqueezy.lemonsqueezy.checkout.frappe.db.exists",
             return_value=True,
@@ -363,12 +361,61 @@ class TestPaymentUrlIssuance(FrappeTestCase):
             "lemonsqueezy.lemonsqueezy.checkout.frappe.get_doc",
             side_effect=fake_get_doc,
         ), patch(
-            "lemonsqueezy.lemonsqueezy.checkout.frappe.get_all",
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.sql",
             return_value=[],
         ), patch(
             "lemonsqueezy.lemonsqueezy.checkout.frappe.db.get_value",
-            return_value=None,
+            side_effect=fake_get_value,
         ):
             checkout_request = build_checkout_request("ACC-PRQ-2026-00007", settings)
 
         self.assertEqual(checkout_request["checkout_kwargs"]["amount"], 25)
+
+    def test_build_checkout_request_resolves_invoice_subscription_plan_in_one_query(self):
+        payment_request = frappe._dict(
+            {
+                "name": "PR-0001",
+                "status": "Requested",
+                "reference_doctype": "Sales Invoice",
+                "reference_name": "SINV-0001",
+                "currency": "USD",
+                "grand_total": 120,
+            }
+        )
+        invoice = frappe._dict({"outstanding_amount": 120, "status": "Unpaid"})
+        settings = SimpleNamespace(verbose_logging=False)
+
+        def fake_get_doc(doctype, name):
+            if doctype == "Payment Request":
+                return payment_request
+            raise AssertionError(f"Unexpected doctype {doctype}")
+
+        def fake_get_value(doctype, name=None, fieldname=None, **kwargs):
+            if doctype == "Sales Invoice" and fieldname == ["outstanding_amount", "status"]:
+                return invoice
+            return None
+
+        def fake_sql(query, values=None, **kwargs):
+            if "tabSubscription Plan Detail" in query:
+                self.assertIn("JOIN `tabSales Invoice` si ON si.subscription = spd.parent", query)
+                self.assertEqual(values["sales_invoice"], "SINV-0001")
+                return [frappe._dict({"plan": "PLAN-001", "product_price_id": "VAR-SUB-001"})]
+            return []
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.exists",
+            return_value=True,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.get_doc",
+            side_effect=fake_get_doc,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.sql",
+            side_effect=fake_sql,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.checkout.frappe.db.get_value",
+            side_effect=fake_get_value,
+        ) as get_value:
+            checkout_request = build_checkout_request("PR-0001", settings)
+
+        self.assertEqual(checkout_request["checkout_kwargs"]["variant_id"], "VAR-SUB-001")
+        get_value.assert_called_once()
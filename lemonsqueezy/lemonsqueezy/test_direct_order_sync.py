@@ -1,15 +1,25 @@
 # Copyright (c) 2026, Ernesto Ruiz and Contributors
 # See license.txt
 
+from datetime import datetime, timezone
 from types import SimpleNamespace
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import frappe
 from frappe.tests.utils import FrappeTestCase
 
 from lemonsqueezy.lemonsqueezy.api import (
+    _amounts_from_cents,
+    _as_administrator,
+    _cents_to_amount,
+    _find_customer_by_email,
+    _get_billing_interval,
+    _resolve_variant_mapping,
+    _to_naive_datetime,
     ensure_customer_for_webhook,
+    process_subscription_event,
     sync_direct_order_to_erpnext,
+    upsert_lemonsqueezy_order,
 )
 
 
@@ -26,6 +36,24 @@ class _FakeCustomerDoc:
         return self
 
 
+class _FakeSubscriptionDoc:
+    def __init__(self, **fields):
+        self.customer = None
+        self.customer_email = None
+        self.insert = Mock()
+        self.save = Mock()
+        self.__dict__.update(fields)
+
+    def set(self, fieldname, value):
+        setattr(self, fieldname, value)
+
+    def update(self, values):
+        self.__dict__.update(values)
+
+    def as_dict(self):
+        return frappe._dict({key: value for key, value in vars(self).items() if not callable(value)})
+
+
 class TestDirectOrderSync(FrappeTestCase):
     def test_ensure_customer_for_webhook_creates_customer_with_defaults(self):
         fake_customer = _FakeCustomerDoc()
@@ -108,3 +136,232 @@ class TestDirectOrderSync(FrappeTestCase):
         self.assertEqual(result["payment_entry_name"], "ACC-PAY-0001")
         create_invoice.assert_called_once()
         create_payment.assert_called_once_with(order_context, "ACC-SINV-0001", {"company": "Sol Hogar", "payment_account": "LemonSqueeze USD - SH", "gateway_account": "LS - SH"})
+
+    def test_amounts_from_cents_converts_to_exact_currency_units(self):
+        amounts = _amounts_from_cents({"total": 115, "tax": None}, ("total", "subtotal", "tax"))
+
+        self.assertEqual(amounts, {"total": 1.15, "subtotal": 0, "tax": 0})
+
+    def test_cents_to_amount_converts_a_single_value(self):
+        self.assertEqual(_cents_to_amount(115), 1.15)
+        self.assertEqual(_cents_to_amount(None), 0)
+
+    def test_to_naive_datetime_parses_lemonsqueezy_timestamps(self):
+        self.assertEqual(
+            _to_naive_datetime("2024-01-31T10:15:00.000000Z"),
+            datetime(2024, 1, 31, 10, 15),
+        )
+        self.assertIsNone(_to_naive_datetime(None))
+
+    def test_to_naive_datetime_accepts_non_string_values(self):
+        self.assertEqual(_to_naive_datetime(1706696100), datetime(2024, 1, 31, 10, 15))
+        self.assertEqual(
+            _to_naive_datetime(datetime(2024, 1, 31, 10, 15, tzinfo=timezone.utc)),
+            datetime(2024, 1, 31, 10, 15),
+        )
+
+    def test_upsert_lemonsqueezy_order_inserts_new_order_in_one_write(self):
+        order_doc = frappe._dict(
+            customer=None,
+            subscription_id=None,
+            subscription=None,
+            order_date=None,
+            currency=None,
+            product_name=None,
+            variant_name=None,
+            variant_id=None,
+            is_new=lambda: True,
+            insert=Mock(),
+            save=Mock(),
+        )
+        order_context = {
+            "order_id": "12345",
+            "paid_amount": 10.0,
+            "paid_currency": "USD",
+            "order_date": "2024-01-31T10:15:00.000000Z",
+        }
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.db.get_value") as get_value:
+            result = upsert_lemonsqueezy_order(
+                order_context,
+                order_doc=order_doc,
+                values={"subtotal": 9.0, "tax": 1.0},
+            )
+
+        self.assertIs(result, order_doc)
+        self.assertEqual(order_doc.order_id, "12345")
+        self.assertEqual(order_doc.subtotal, 9.0)
+        order_doc.insert.assert_called_once()
+        order_doc.save.assert_not_called()
+        get_value.assert_not_called()
+
+    def test_upsert_lemonsqueezy_order_updates_row_inserted_concurrently(self):
+        new_doc = frappe._dict(
+            customer=None,
+            subscription_id=None,
+            subscription=None,
+            order_date=None,
+            currency=None,
+            product_name=None,
+            variant_name=None,
+            variant_id=None,
+            is_new=lambda: True,
+            insert=Mock(side_effect=frappe.DuplicateEntryError),
+            save=Mock(),
+        )
+        existing_doc = frappe._dict(
+            name="LSO-0001",
+            order_id="12345",
+            customer="CUST-0001",
+            subscription_id=None,
+            subscription=None,
+            order_date=None,
+            currency="USD",
+            product_name=None,
+            variant_name=None,
+            variant_id=None,
+            is_new=lambda: False,
+            insert=Mock(),
+            save=Mock(),
+        )
+        order_context = {"order_id": "12345", "paid_amount": 10.0, "paid_currency": "USD"}
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.get_value",
+            return_value="LSO-0001",
+        ) as get_value, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_doc",
+            return_value=existing_doc,
+        ) as get_doc:
+            result = upsert_lemonsqueezy_order(order_context, order_doc=new_doc, values={"tax": 1.0})
+
+        self.assertIs(result, existing_doc)
+        self.assertEqual(existing_doc.total, 10.0)
+        self.assertEqual(existing_doc.tax, 1.0)
+        existing_doc.save.assert_called_once()
+        self.assertTrue(get_value.call_args.kwargs["for_update"])
+        self.assertTrue(get_doc.call_args.kwargs["for_update"])
+
+    def test_find_customer_by_email_uses_a_single_query(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.sql",
+            return_value=[frappe._dict(customer="CUST-0001", priority=1)],
+        ) as sql:
+            customer = _find_customer_by_email(" Buyer@Example.com ")
+
+        self.assertEqual(customer, "CUST-0001")
+        sql.assert_called_once()
+        self.assertEqual(sql.call_args.args[1], {"email": "buyer@example.com"})
+
+    def test_ensure_customer_for_webhook_skips_malformed_email(self):
+        settings = SimpleNamespace(default_customer_group="Retail", default_territory="All Territories")
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.exists",
+            return_value=True,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.log_error",
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api._find_customer_by_email",
+        ) as find_customer, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.new_doc",
+        ) as new_doc:
+            customer = ensure_customer_for_webhook("not-an-email", settings)
+
+        self.assertIsNone(customer)
+        find_customer.assert_not_called()
+        new_doc.assert_not_called()
+
+    def test_get_billing_interval_classifies_variant_names(self):
+        self.assertEqual(_get_billing_interval("Pro (Monthly)"), "Monthly")
+        self.assertEqual(_get_billing_interval("per YEAR"), "Yearly")
+        self.assertEqual(_get_billing_interval("Weekly digest"), "Weekly")
+        # Matched anywhere in the name, so unhyphenated compounds are classified too
+        self.assertEqual(_get_billing_interval("Bi-weekly"), "Weekly")
+        self.assertEqual(_get_billing_interval("Biweekly"), "Weekly")
+        self.assertIsNone(_get_billing_interval("Lifetime"))
+        self.assertIsNone(_get_billing_interval(None))
+
+    def test_get_billing_interval_does_not_treat_annual_as_yearly(self):
+        self.assertIsNone(_get_billing_interval("Annual Plan"))
+        self.assertIsNone(_get_billing_interval("Semi-annual"))
+        self.assertIsNone(_get_billing_interval("Biannual"))
+
+    def test_resolve_variant_mapping_reads_plan_and_item_in_one_query(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.has_column",
+            side_effect=lambda doctype, fieldname: fieldname in ("product_price_id", "item"),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.exists",
+            return_value=True,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.get_value",
+            return_value=frappe._dict(name="PLAN-USD", item="ITEM-SUB"),
+        ) as get_value:
+            mapping = _resolve_variant_mapping("44565")
+
+        self.assertEqual(mapping, {"item_code": "ITEM-SUB", "subscription_plan": "PLAN-USD"})
+        get_value.assert_called_once_with(
+            "Subscription Plan",
+            {"product_price_id": "44565"},
+            ["name", "item"],
+            as_dict=1,
+        )
+
+    def test_as_administrator_switches_and_restores_guest_session(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.session",
+            new=SimpleNamespace(user="Guest"),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.set_user",
+        ) as set_user:
+            with self.assertRaises(ValueError):
+                with _as_administrator():
+                    raise ValueError("boom")
+
+        self.assertEqual([call.args[0] for call in set_user.call_args_list], ["Administrator", "Guest"])
+
+    def test_as_administrator_skips_switch_for_administrator(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.session",
+            new=SimpleNamespace(user="Administrator"),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.set_user",
+        ) as set_user:
+            with _as_administrator():
+                pass
+
+        set_user.assert_not_called()
+
+    def test_subscription_created_concurrently_is_updated_instead(self):
+        new_doc = _FakeSubscriptionDoc(insert=Mock(side_effect=frappe.DuplicateEntryError))
+        existing_doc = _FakeSubscriptionDoc(
+            name="SUB-0001",
+            subscription_id="sub_123",
+            status="on_trial",
+            customer="CUST-0001",
+            customer_email="buyer@example.com",
+        )
+        data = {"data": {"id": "sub_123", "attributes": {"status": "active", "user_email": "buyer@example.com"}}}
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.get_value",
+            side_effect=[None, "SUB-0001", "SUB-0001"],
+        ) as get_value, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.new_doc",
+            return_value=new_doc,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_doc",
+            return_value=existing_doc,
+        ) as get_doc, patch(
+            "lemonsqueezy.lemonsqueezy.api.ensure_customer_for_webhook",
+            return_value="CUST-0001",
+        ):
+            process_subscription_event(data, SimpleNamespace(), "subscription_created")
+
+        self.assertEqual(existing_doc.status, "active")
+        existing_doc.save.assert_called_once()
+        self.assertFalse(get_value.call_args_list[0].kwargs["for_update"])
+        self.assertTrue(get_value.call_args_list[1].kwargs["for_update"])
+        self.assertTrue(get_value.call_args_list[2].kwargs["for_update"])
+        self.assertTrue(get_doc.call_args.kwargs["for_update"])
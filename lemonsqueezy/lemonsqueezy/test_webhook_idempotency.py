@@ -1,14 +1,20 @@
 # Copyright (c) 2026, Ernesto Ruiz and Contributors
 # See license.txt
 
+import hashlib
+import hmac
+from datetime import datetime, timedelta
 from types import SimpleNamespace
 from unittest.mock import Mock, patch
 
 from frappe.tests.utils import FrappeTestCase
 
+from lemonsqueezy.lemonsqueezy import api
 from lemonsqueezy.lemonsqueezy.api import (
+    WEBHOOK_PROCESSING_SAVEPOINT,
     build_webhook_idempotency_key,
     get_existing_payment_entry,
+    handle_webhook,
     reserve_webhook_log,
 )
 
@@ -39,6 +45,19 @@ class TestWebhookIdempotency(FrappeTestCase):
         self.assertTrue(key.startswith("subscription_updated:sub_123:"))
         self.assertEqual(resource_id, "sub_123")
 
+    def test_payload_hash_without_raw_body_ignores_key_order(self):
+        first = {"meta": {"event_name": "subscription_updated"}, "data": {"id": "sub_123", "type": "subscriptions"}}
+        second = {"data": {"type": "subscriptions", "id": "sub_123"}, "meta": {"event_name": "subscription_updated"}}
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.request",
+            SimpleNamespace(headers={}),
+        ):
+            first_key, _ = build_webhook_idempotency_key(first, None)
+            second_key, _ = build_webhook_idempotency_key(second, None)
+
+        self.assertEqual(first_key, second_key)
+
     def test_get_existing_payment_entry_returns_document(self):
         payment_entry = SimpleNamespace(name="ACC-PAY-0001")
 
@@ -53,6 +72,50 @@ class TestWebhookIdempotency(FrappeTestCase):
 
         self.assertIs(result, payment_entry)
 
+    def test_reserve_webhook_log_skips_log_still_processing(self):
+        log_doc = SimpleNamespace(status="Processing", modified=datetime.now(), save=Mock())
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.get_webhook_log_row",
+            return_value=SimpleNamespace(name="WH-0001", status="Processing"),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_doc",
+            return_value=log_doc,
+        ):
+            _, should_process = reserve_webhook_log(
+                event_name="order_created",
+                payload={"ok": True},
+                idempotency_key="order_created:12345",
+                resource_id="12345",
+            )
+
+        self.assertFalse(should_process)
+        log_doc.save.assert_not_called()
+
+    def test_reserve_webhook_log_retries_stale_processing_log(self):
+        log_doc = SimpleNamespace(
+            status="Processing",
+            modified=datetime.now() - timedelta(seconds=api.WEBHOOK_JOB_TIMEOUT + 60),
+            save=Mock(),
+        )
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.get_webhook_log_row",
+            return_value=SimpleNamespace(name="WH-0001", status="Processing"),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_doc",
+            return_value=log_doc,
+        ):
+            _, should_process = reserve_webhook_log(
+                event_name="order_created",
+                payload={"ok": True},
+                idempotency_key="order_created:12345",
+                resource_id="12345",
+            )
+
+        self.assertTrue(should_process)
+        log_doc.save.assert_called_once()
+
     def test_reserve_webhook_log_reuses_failed_log_for_retry(self):
         log_doc = SimpleNamespace(
             status="Failed",
@@ -84,3 +147,118 @@ class TestWebhookIdempotency(FrappeTestCase):
         self.assertIsNone(log_doc.error_message)
         self.assertIsNone(log_doc.payment_entry)
         log_doc.save.assert_called_once()
+
+
+class TestWebhookTransaction(FrappeTestCase):
+    def setUp(self):
+        api._LAST_MATCHED_SETTINGS.clear()
+
+    def tearDown(self):
+        api._LAST_MATCHED_SETTINGS.clear()
+
+    def _run_webhook(self, process_side_effect=None, background=0, enqueue_side_effect=None):
+        raw_body = b'{"meta":{"event_name":"subscription_updated"},"data":{"id":"sub_123","attributes":{}}}'
+        signature = hmac.new(b"whsec", raw_body, hashlib.sha256).hexdigest()
+        request = SimpleNamespace(
+            headers={"X-Signature": signature},
+            args={},
+            content_length=len(raw_body),
+            get_data=lambda **kwargs: raw_body,
+        )
+        log_doc = SimpleNamespace(name="WH-0001", status="Processing", save=Mock())
+        log_doc.db_set = Mock(side_effect=lambda values: log_doc.__dict__.update(values))
+        db = Mock()
+        process_event = Mock(side_effect=process_side_effect)
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db",
+            db,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.get_signature_candidate_settings",
+            return_value=["LemonSqueezy-Standard"],
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api._get_webhook_secrets",
+            return_value=[("LemonSqueezy-Standard", b"whsec")],
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_cached_doc",
+            side_effect=lambda doctype, name: SimpleNamespace(
+                name=name,
+                sanitize_webhook_payload=0,
+                verbose_logging=0,
+                process_webhooks_in_background=background,
+            ),
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_doc",
+            return_value=log_doc,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.reserve_webhook_log",
+            return_value=(log_doc, True),
+        ) as reserve, patch.dict(
+            "lemonsqueezy.lemonsqueezy.api.WEBHOOK_EVENT_HANDLERS",
+            {"subscription_updated": process_event},
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.enqueue",
+            side_effect=enqueue_side_effect,
+        ) as enqueue, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.log_error",
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.local",
+            SimpleNamespace(site="test_site", response={}),
+        ):
+            self.process_event = process_event
+            self.enqueue = enqueue
+            self.reserve = reserve
+            self.raw_body = raw_body
+            self.last_log_doc = log_doc
+            self.last_db = db
+            result = handle_webhook()
+
+        return result, log_doc, db
+
+    def test_successful_webhook_commits_once(self):
+        result, log_doc, db = self._run_webhook()
+
+        self.assertEqual(result, {"status": "success"})
+        self.assertEqual(log_doc.status, "Success")
+        log_doc.save.assert_not_called()
+        db.commit.assert_called_once()
+
+    def test_matched_settings_are_tried_first_next_time(self):
+        self._run_webhook()
+
+        self.assertEqual(api._LAST_MATCHED_SETTINGS["test_site"], "LemonSqueezy-Standard")
+
+    def test_unsanitized_payload_is_logged_as_received(self):
+        self._run_webhook()
+
+        self.assertEqual(self.reserve.call_args.kwargs["payload"], self.raw_body.decode())
+
+    def test_failed_webhook_commits_failure_log_once(self):
+        result, log_doc, db = self._run_webhook(process_side_effect=Exception("boom"))
+
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(log_doc.status, "Failed")
+        db.rollback.assert_called_once_with(save_point=WEBHOOK_PROCESSING_SAVEPOINT)
+        db.commit.assert_called_once()
+
+    def test_background_mode_enqueues_reserved_webhook(self):
+        result, log_doc, db = self._run_webhook(background=1)
+
+        self.assertEqual(result["message"], "Event queued")
+        self.assertEqual(log_doc.status, "Processing")
+        db.commit.assert_called_once()
+        self.process_event.assert_not_called()
+        self.enqueue.assert_called_once()
+        self.assertEqual(self.enqueue.call_args.kwargs["log_name"], "WH-0001")
+        self.assertEqual(self.enqueue.call_args.kwargs["job_id"], "lemonsqueezy_webhook::WH-0001")
+        self.assertTrue(self.enqueue.call_args.kwargs["deduplicate"])
+        self.assertEqual(self.enqueue.call_args.kwargs["settings_name"], "LemonSqueezy-Standard")
+
+    def test_background_enqueue_failure_marks_log_failed(self):
+        with self.assertRaises(ConnectionError):
+            self._run_webhook(background=1, enqueue_side_effect=ConnectionError("redis down"))
+
+        self.assertEqual(self.enqueue.call_args.kwargs["timeout"], api.WEBHOOK_JOB_TIMEOUT)
+        self.assertEqual(self.last_log_doc.status, "Failed")
+        self.assertIn("redis down", self.last_log_doc.error_message)
+        self.assertEqual(self.last_db.commit.call_count, 2)
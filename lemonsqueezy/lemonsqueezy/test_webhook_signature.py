@@ -0,0 +1,243 @@
+# Copyright (c) 2026, Ernesto Ruiz and Contributors
+# See license.txt
+
+from types import SimpleNamespace
+from unittest.mock import Mock, call, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from lemonsqueezy.lemonsqueezy import api
+from lemonsqueezy.lemonsqueezy.api import (
+    _get_webhook_secrets,
+    clear_webhook_settings_cache,
+    get_signature_candidate_settings,
+    handle_webhook,
+)
+
+
+class TestWebhookSecretCache(FrappeTestCase):
+    def setUp(self):
+        api._SECRET_CACHE.clear()
+
+    def tearDown(self):
+        api._SECRET_CACHE.clear()
+
+    def test_secrets_are_loaded_in_one_query_and_reused(self):
+        rows = [
+            frappe._dict(name="LemonSqueezy-Standard", password="enc-standard"),
+            frappe._dict(name="LemonSqueezy-Subscription", password="enc-subscription"),
+        ]
+        names = ["LemonSqueezy-Standard", "LemonSqueezy-Subscription", "LemonSqueezy-NoSecret"]
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.sql",
+            return_value=rows,
+        ) as sql, patch(
+            "lemonsqueezy.lemonsqueezy.api.decrypt",
+            side_effect=lambda value: value.replace("enc-", "whsec-"),
+        ) as decrypt, patch(
+            "lemonsqueezy.lemonsqueezy.api._get_webhook_secret_version",
+            return_value="v1",
+        ):
+            first = _get_webhook_secrets(names)
+            second = _get_webhook_secrets(names)
+
+        expected = [
+            ("LemonSqueezy-Standard", b"whsec-standard"),
+            ("LemonSqueezy-Subscription", b"whsec-subscription"),
+        ]
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+        sql.assert_called_once()
+        self.assertEqual(sql.call_args.args[1], (tuple(names),))
+        self.assertEqual(decrypt.call_count, 2)
+
+    def test_settings_update_invalidates_cached_secret(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.sql",
+            side_effect=[
+                [frappe._dict(name="LemonSqueezy-Standard", password="old-secret")],
+                [frappe._dict(name="LemonSqueezy-Standard", password="new-secret")],
+            ],
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.decrypt",
+            side_effect=lambda value: value,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.cache",
+        ) as cache, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.after_commit",
+        ):
+            self.assertEqual(
+                _get_webhook_secrets(["LemonSqueezy-Standard"]),
+                [("LemonSqueezy-Standard", b"old-secret")],
+            )
+            clear_webhook_settings_cache(SimpleNamespace(name="LemonSqueezy-Standard"))
+            self.assertEqual(
+                _get_webhook_secrets(["LemonSqueezy-Standard"]),
+                [("LemonSqueezy-Standard", b"new-secret")],
+            )
+
+        self.assertEqual(
+            cache.return_value.hdel.call_args_list,
+            [call("lemonsqueezy", "enabled_settings"), call("lemonsqueezy", "webhook_secret_version")],
+        )
+
+    def test_enabled_settings_are_cleared_again_after_commit(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.cache",
+        ) as cache, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.after_commit",
+        ) as after_commit:
+            clear_webhook_settings_cache(SimpleNamespace(name="LemonSqueezy-Standard"))
+            after_commit.add.assert_called_once()
+            cache.return_value.hdel.reset_mock()
+            after_commit.add.call_args.args[0]()
+
+        cache.return_value.hdel.assert_any_call("lemonsqueezy", "enabled_settings")
+
+    def test_secret_cache_and_version_are_cleared_again_after_commit(self):
+        key = ("test_site", "LemonSqueezy-Standard")
+
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.cache",
+        ) as cache, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.after_commit",
+        ) as after_commit, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.local",
+            SimpleNamespace(site="test_site"),
+        ):
+            clear_webhook_settings_cache(SimpleNamespace(name="LemonSqueezy-Standard"))
+            after_commit.add.assert_called_once()
+            # Another webhook re-cached the old secret before the save committed
+            api._SECRET_CACHE[key] = ("v2", 0, b"old-secret")
+            cache.return_value.hdel.reset_mock()
+            after_commit.add.call_args.args[0]()
+
+        self.assertNotIn(key, api._SECRET_CACHE)
+        cache.return_value.hdel.assert_any_call("lemonsqueezy", "webhook_secret_version")
+
+    def test_secret_version_change_from_another_process_reloads_secret(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.sql",
+            side_effect=[
+                [frappe._dict(name="LemonSqueezy-Standard", password="old-secret")],
+                [frappe._dict(name="LemonSqueezy-Standard", password="new-secret")],
+            ],
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.decrypt",
+            side_effect=lambda value: value,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api._get_webhook_secret_version",
+            side_effect=["v1", "v2"],
+        ):
+            first = _get_webhook_secrets(["LemonSqueezy-Standard"])
+            second = _get_webhook_secrets(["LemonSqueezy-Standard"])
+
+        self.assertEqual(first, [("LemonSqueezy-Standard", b"old-secret")])
+        self.assertEqual(second, [("LemonSqueezy-Standard", b"new-secret")])
+
+    def test_missing_secret_is_not_cached(self):
+        with patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.sql",
+            side_effect=[[], [frappe._dict(name="LemonSqueezy-Standard", password="whsec")]],
+        ) as sql, patch(
+            "lemonsqueezy.lemonsqueezy.api.decrypt",
+            side_effect=lambda value: value,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api._get_webhook_secret_version",
+            return_value="v1",
+        ):
+            self.assertEqual(_get_webhook_secrets(["LemonSqueezy-Standard"]), [])
+            self.assertEqual(
+                _get_webhook_secrets(["LemonSqueezy-Standard"]),
+                [("LemonSqueezy-Standard", b"whsec")],
+            )
+
+        self.assertEqual(sql.call_count, 2)
+
+
+class TestSignatureCandidates(FrappeTestCase):
+    def test_key_id_header_limits_candidates_to_one_settings_doc(self):
+        request = SimpleNamespace(headers={"X-Signature-KeyId": "LemonSqueezy-Standard"}, args={})
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.get_value",
+            return_value="LemonSqueezy-Standard",
+        ) as get_value, patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.get_all",
+        ) as get_all:
+            candidates = get_signature_candidate_settings()
+
+        self.assertEqual(candidates, ["LemonSqueezy-Standard"])
+        get_value.assert_called_once_with(
+            "LemonSqueezy Settings",
+            {"name": "LemonSqueezy-Standard", "enabled": 1},
+            "name",
+        )
+        get_all.assert_not_called()
+
+    def test_unknown_key_id_yields_no_candidates(self):
+        request = SimpleNamespace(headers={}, args={"settings": "LemonSqueezy-Missing"})
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.db.get_value",
+            return_value=None,
+        ):
+            self.assertEqual(get_signature_candidate_settings(), [])
+
+    def test_without_key_id_every_enabled_settings_doc_is_a_candidate(self):
+        request = SimpleNamespace(headers={}, args={})
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.get_enabled_settings_names",
+            return_value=["LemonSqueezy-Standard", "LemonSqueezy-Subscription"],
+        ):
+            candidates = get_signature_candidate_settings()
+
+        self.assertEqual(candidates, ["LemonSqueezy-Standard", "LemonSqueezy-Subscription"])
+
+
+class TestWebhookSignatureFormat(FrappeTestCase):
+    def test_non_hex_signature_is_rejected_before_any_lookup(self):
+        request = SimpleNamespace(
+            headers={"X-Signature": "not-a-hex-digest"},
+            args={},
+            get_data=lambda **kwargs: b"{}",
+        )
+        local = SimpleNamespace(response={})
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.local",
+            local,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.log_error",
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.get_signature_candidate_settings",
+        ) as get_candidates:
+            result = handle_webhook()
+
+        self.assertEqual(result["message"], "Invalid signature")
+        self.assertEqual(local.response["http_status_code"], 401)
+        get_candidates.assert_not_called()
+
+    def test_declared_oversized_body_is_rejected_without_reading_it(self):
+        request = SimpleNamespace(
+            headers={"X-Signature": "ab" * 32},
+            args={},
+            content_length=api.MAX_WEBHOOK_BODY_BYTES + 1,
+            get_data=Mock(),
+        )
+        local = SimpleNamespace(response={})
+
+        with patch("lemonsqueezy.lemonsqueezy.api.frappe.request", request), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.local",
+            local,
+        ), patch(
+            "lemonsqueezy.lemonsqueezy.api.frappe.log_error",
+        ):
+            result = handle_webhook()
+
+        self.assertEqual(result["message"], "Payload too large")
+        self.assertEqual(local.response["http_status_code"], 413)
+        request.get_data.assert_not_called()
@@ -0,0 +1,13 @@
+import frappe
+
+
+def execute():
+    """Index Item.lemonsqueezy_variant_id, which webhooks use to resolve variants."""
+    if not frappe.db.has_column("Item", "lemonsqueezy_variant_id"):
+        return
+
+    if frappe.db.exists("Custom Field", "Item-lemonsqueezy_variant_id"):
+        frappe.db.set_value("Custom Field", "Item-lemonsqueezy_variant_id", "search_index", 1, update_modified=False)
+
+    frappe.db.add_index("Item", ["lemonsqueezy_variant_id"])
+    frappe.db.commit()
@@ -15,7 +15,8 @@ def execute():
 				"translatable": 0,
 				"read_only": 0,
 				"print_hide": 1,
-				"no_copy": 0
+				"no_copy": 0,
+				"search_index": 1
 			}
 		]
 	}